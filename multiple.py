@@ -1,84 +1,519 @@
 import streamlit as st
-import google.generativeai as genai
 import os
-import json
-from PIL import Image
-from dotenv import find_dotenv, load_dotenv
 import re
-from io import StringIO
+import hashlib
+import sqlite3
+import threading
+from collections import namedtuple
+from typing import TypedDict
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
 
-load_dotenv(find_dotenv(), override=True)
-gemini_api_key = os.getenv("GOOGLE_API_KEY")
+# Fixed instructions for image analysis
+ANALYZE_PROMPT = """
+    Analyze the given image and identify each piece of clothing.
+    For each item, provide a description, category, colors, and style.
+    Ensure the output is a valid JSON array of objects with this structure:
+    [{"description": "", "category": "", "colors": [], "style": [], "gender_type": "", "suitable_weather": "", "material": "", "occasion": ""}]
+    Socks arent undergarments.
+    Only output the JSON array. Do not include any extra text or formatting outside the JSON.
+"""
 
-if not gemini_api_key:
-    st.error("GEMINI_API_KEY is not set in the environment variables.")
-    st.stop()
+# Fixed instructions for analyzing several images in one request
+BATCH_ANALYZE_PROMPT = """
+    Analyze each of the given images separately and identify each piece of clothing in it.
+    For each item, provide a description, category, colors, and style.
+    Ensure the output is a valid JSON array with one inner array per input image, in the same order as the images.
+    Each inner array holds objects with this structure:
+    [{"description": "", "category": "", "colors": [], "style": [], "gender_type": "", "suitable_weather": "", "material": "", "occasion": ""}]
+    Socks arent undergarments.
+    Only output the JSON array of arrays. Do not include any extra text or formatting outside the JSON.
+"""
 
-genai.configure(api_key=gemini_api_key)
-model = genai.GenerativeModel('gemini-1.5-flash')
+# Sent alongside the images of a batch request
+BATCH_COUNT_PROMPT = "There are {count} images. Return exactly {count} inner arrays."
 
 
-def analyze_image(image):
-    try:
-        # Define the prompt
-        prompt = """
-            Analyze the given image and identify each piece of clothing.
-            For each item, provide a description, category, colors, and style.
-            Ensure the output is a valid JSON array of objects with this structure:
-            [{"description": "", "category": "", "colors": [], "style": [], "gender_type": "", "suitable_weather": "", "material": "", "occasion": ""}]
-            Socks arent undergarments.
-            Only output the JSON array. Do not include any extra text or formatting outside the JSON.
-        """
-
-        # Open the uploaded image
-        image_data = Image.open(image)
-
-        # Send the prompt and image to Gemini
-        response = model.generate_content([prompt, image_data])
-        raw_response = response.text.strip()
-
-        # Extract JSON using regex (to handle improperly formatted responses)
-        json_match = re.search(r'\[\s*\{.*\}\s*\]', raw_response, re.DOTALL)
-        if json_match:
-            cleaned_json = json_match.group(0)  # Extract the JSON array
-        else:
-            st.error("Failed to extract JSON from the response. Please check the format.")
-            return None
+class _ItemSchema(TypedDict):
+    """JSON shape of one clothing item, matching the structure in ANALYZE_PROMPT."""
+    description: str
+    category: str
+    colors: list[str]
+    style: list[str]
+    gender_type: str
+    suitable_weather: str
+    material: str
+    occasion: str
 
-        # Try parsing the extracted JSON
-        try:
-            json_response = json.loads(cleaned_json)
-            if isinstance(json_response, list):
-                return json_response  # Valid JSON array
+
+# JSON mode plus a response schema makes Gemini emit the bare array, so parsing is a single pass;
+# temperature 0 keeps repeated analyses of the same image identical
+ANALYZE_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": list[_ItemSchema],
+    "temperature": 0,
+    "max_output_tokens": 2048,
+}
+# Batch requests return one item array per image
+BATCH_ANALYZE_CONFIG = {**ANALYZE_CONFIG, "response_schema": list[list[_ItemSchema]]}
+OUTFIT_CONFIG = {"temperature": 0.7}
+# gemini-1.5-flash rejects requests asking for more output tokens than this
+MODEL_MAX_OUTPUT_TOKENS = 8192
+# Keeps a hung Gemini request from blocking the script runner indefinitely
+REQUEST_OPTIONS = {"timeout": 30}
+
+# Upper bound on concurrent Gemini requests from a single dashboard run
+MAX_ANALYZE_WORKERS = 8
+# Images sent together in one analyze request
+MAX_IMAGES_PER_REQUEST = 4
+# Gemini tiles images at 768px, so anything larger only costs upload time and tokens
+MAX_ANALYZE_SIZE = (1024, 1024)
+# Gemini rejects inline requests above 20 MB, so larger uploads are refused up front
+MAX_UPLOAD_BYTES = 20_000_000
+# The dashboard preview never needs more than this
+PREVIEW_SIZE = (512, 512)
+# Analyzed catalogs are persisted here unless CATALOG_DB_PATH says otherwise
+DEFAULT_CATALOG_DB_PATH = "wardrobe_catalog.db"
+
+
+# One analyzed piece of clothing; fields mirror the JSON structure requested in ANALYZE_PROMPT
+ClothingItem = namedtuple(
+    'ClothingItem',
+    'description category colors style gender_type suitable_weather material occasion',
+)
+# Shown in place of any field Gemini leaves out or empty
+_ITEM_DEFAULTS = ClothingItem('N/A', 'N/A', ('N/A',), ('N/A',), 'N/A', 'N/A', 'N/A', 'N/A')
+
+
+def _as_strings(value):
+    """Flatten a JSON value into a tuple of non-empty strings."""
+    if value is None:
+        return ()
+    if not isinstance(value, (list, tuple)):
+        value = (value,)
+    return tuple(str(part) for part in value if part is not None and part != '')
+
+
+def _to_clothing_items(parsed):
+    """Convert parsed item dicts to ``ClothingItem``s.
+
+    List fields become tuples of strings and every other field a string, whatever types
+    Gemini actually returned; missing or empty fields become N/A.
+    """
+    items = []
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        fields = []
+        for field, default in zip(ClothingItem._fields, _ITEM_DEFAULTS):
+            values = _as_strings(item.get(field))
+            if isinstance(default, tuple):
+                fields.append(values or default)
             else:
-                st.error("The response should be an array of objects.")
-                return None
-        except json.JSONDecodeError as e:
-            st.error(f"Error parsing JSON from the cleaned response: {e}")
-            return None
+                fields.append(', '.join(values) or default)
+        items.append(ClothingItem._make(fields))
+    return items
 
-    except Exception as e:
-        st.error(f"Error analyzing image: {e}")
+
+@st.cache_resource(show_spinner=False)
+def _get_api_key():
+    """Load ``.env`` and read the Gemini API key once per server process."""
+    from dotenv import find_dotenv, load_dotenv
+
+    load_dotenv(find_dotenv(), override=True)
+    gemini_api_key = os.getenv("GOOGLE_API_KEY")
+    if not gemini_api_key:
+        raise RuntimeError("GEMINI_API_KEY is not set in the environment variables.")
+    return gemini_api_key
+
+
+@st.cache_resource(show_spinner=False)
+def _get_genai():
+    """Import and configure the Gemini SDK on the first model request, once per server process."""
+    import google.generativeai as genai
+
+    genai.configure(api_key=_get_api_key())
+    return genai
+
+
+# The model objects are cached, so every rerun, session and worker thread reuses the same ones.
+@st.cache_resource(show_spinner=False)
+def get_outfit_model():
+    return _get_genai().GenerativeModel('gemini-1.5-flash', generation_config=OUTFIT_CONFIG)
+
+
+@st.cache_resource(show_spinner=False)
+def get_analyze_model():
+    # The analyze prompt is set once on the model as its system instruction; the SDK still
+    # includes it in every request
+    return _get_genai().GenerativeModel(
+        'gemini-1.5-flash',
+        system_instruction=ANALYZE_PROMPT,
+        generation_config=ANALYZE_CONFIG,
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_batch_analyze_model():
+    # Same settings as the single-image model, but instructed to return one array per image
+    return _get_genai().GenerativeModel(
+        'gemini-1.5-flash',
+        system_instruction=BATCH_ANALYZE_PROMPT,
+        generation_config=BATCH_ANALYZE_CONFIG,
+    )
+
+
+def _is_quota_error(error):
+    from google.api_core import exceptions as google_exceptions
+
+    return isinstance(error, google_exceptions.ResourceExhausted)
+
+
+@st.cache_resource
+def get_catalog_db():
+    """Open the catalog store once per server process, shared by every session."""
+    conn = sqlite3.connect(os.getenv("CATALOG_DB_PATH", DEFAULT_CATALOG_DB_PATH), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog (hash BLOB PRIMARY KEY, json BLOB NOT NULL)")
+    return conn, threading.Lock()
+
+
+def image_digest(image_bytes: bytes) -> bytes:
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+
+def load_catalog(digest):
+    """Return the stored catalog for an image digest, or None if it was never analyzed."""
+    conn, lock = get_catalog_db()
+    with lock:
+        row = conn.execute("SELECT json FROM catalog WHERE hash = ?", (digest,)).fetchone()
+    if row is None:
+        return None
+    try:
+        return _to_clothing_items(orjson.loads(row[0]))
+    except orjson.JSONDecodeError:
+        # An unreadable row is a cache miss; the image is re-analyzed and the row overwritten
         return None
 
 
-# Function to generate outfit combinations using Gemini
-def generate_outfit_combinations(catalog):
-    prompt = f"""Given the following clothing catalog, generate at least three distinct outfit combinations. Provide a short description for each outfit.
+def load_catalogs(digests):
+    """Concatenate the stored catalogs for several image digests, skipping unknown ones."""
+    items = []
+    for digest in digests:
+        items.extend(load_catalog(digest) or [])
+    return items
+
+
+def save_catalog(digest, catalog):
+    conn, lock = get_catalog_db()
+    with lock, conn:
+        conn.execute("INSERT OR REPLACE INTO catalog(hash, json) VALUES(?, ?)", (digest, orjson.dumps([item._asdict() for item in catalog])))
+
+
+# Compiled once; no wildcards, so the search is linear even on malformed responses
+_JSON_ARRAY_START_RE = re.compile(r'\[\s*[\[{\]]')
+
 
-        Catalog: {catalog}
+def _extract_json_array(text):
+    """Return the first balanced JSON array in ``text``, or None if there is none.
+
+    A single linear scan that tracks bracket depth and skips over string literals.
     """
+    # Skip prose like "[Note]" by starting at a bracket that opens an object, array or empty list
+    match = _JSON_ARRAY_START_RE.search(text)
+    if match is None:
+        return None
+    start = match.start()
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '[{':
+            depth += 1
+        elif char in ']}':
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return None
+
+
+def validate_image(image_bytes: bytes):
+    """Return why an upload can't be analyzed, or None if it looks like a usable image."""
+    from PIL import Image
+
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        return f"File is larger than {MAX_UPLOAD_BYTES // 1_000_000} MB."
+    try:
+        # verify() checks the file structure without decoding any pixels
+        Image.open(BytesIO(image_bytes)).verify()
+    except Exception:
+        return "File is not a valid image."
+    return None
+
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def downscale_image(image_bytes: bytes) -> bytes:
+    """Shrink an uploaded photo to fit ``MAX_ANALYZE_SIZE`` and re-encode it as JPEG."""
+    from PIL import Image
+
+    image_data = Image.open(BytesIO(image_bytes))
+    image_data.thumbnail(MAX_ANALYZE_SIZE, Image.Resampling.LANCZOS)
+    buffer = BytesIO()
+    image_data.convert('RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def _parse_json_array(raw_response):
+    """Parse a Gemini response that should be a JSON array, raising ValueError otherwise."""
+    # JSON mode normally yields a bare array, so try parsing it as-is first
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        json_response = orjson.loads(raw_response)
+    except orjson.JSONDecodeError:
+        json_response = None
+    if isinstance(json_response, list):
+        return json_response  # Valid JSON array
+
+    # Fall back to cutting the array out of any surrounding text, fences or wrapper object
+    cleaned_json = _extract_json_array(raw_response)
+    if cleaned_json is None:
+        raise ValueError("Failed to extract JSON from the response. Please check the format.")
+    try:
+        return orjson.loads(cleaned_json)
+    except orjson.JSONDecodeError as e:
+        raise ValueError(f"Error parsing JSON from the cleaned response: {e}") from e
+
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def make_preview(image_bytes: bytes) -> bytes:
+    """Return a small JPEG thumbnail so the full upload isn't sent back to the browser."""
+    from PIL import Image
+
+    thumb = Image.open(BytesIO(image_bytes))
+    thumb.thumbnail(PREVIEW_SIZE)
+    buffer = BytesIO()
+    thumb.convert('RGB').save(buffer, format='JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def _image_part(image_bytes: bytes):
+    """Wrap JPEG bytes from ``downscale_image`` as a Gemini blob, skipping any PIL decode."""
+    return {'mime_type': 'image/jpeg', 'data': image_bytes}
+
+
+@st.cache_data(show_spinner=False, max_entries=128)
+def analyze_image(image_bytes: bytes):
+    """Return the clothing catalog for one ``downscale_image`` JPEG, raising on failure.
+
+    Results are cached by image content, so reruns over the same uploads skip Gemini.
+    Items stay plain dicts: pickling a ``ClothingItem`` from the cache fails once another
+    rerun has replaced the script's ``__main__`` module.
+    This runs inside worker threads, so it must not call any ``st.*`` functions.
+    """
+    # Send the encoded bytes as-is; the model adds the prompt as its system instruction
+    response = get_analyze_model().generate_content([_image_part(image_bytes)], request_options=REQUEST_OPTIONS)
+    return _parse_json_array(response.text.strip())
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def analyze_images(images: list):
+    """Return one clothing catalog per image from a single Gemini request, raising on failure.
+
+    Like ``analyze_image`` this is cached by content and must not call any ``st.*`` functions.
+    """
+    contents = [BATCH_COUNT_PROMPT.format(count=len(images))]
+    contents.extend(_image_part(image_bytes) for image_bytes in images)
+
+    # Leave room in the output budget for every image's catalog
+    response = get_batch_analyze_model().generate_content(
+        contents,
+        generation_config={"max_output_tokens": min(ANALYZE_CONFIG["max_output_tokens"] * len(images), MODEL_MAX_OUTPUT_TOKENS)},
+        request_options=REQUEST_OPTIONS,
+    )
+    catalogs = _parse_json_array(response.text.strip())
+    if len(catalogs) != len(images) or not all(isinstance(catalog, list) for catalog in catalogs):
+        raise ValueError(f"Expected {len(images)} catalogs in the response, one per image.")
+    return catalogs
+
+
+class QuotaSkipped(Exception):
+    """Stands in for an image that was never sent because the Gemini quota ran out."""
+
+
+def _analyze_uploads(images, quota_exhausted):
+    """Worker wrapper: return one catalog or exception per image instead of raising.
+
+    The first worker to hit the Gemini quota sets ``quota_exhausted``; every worker checks
+    it before each request and reports the images it hasn't sent as ``QuotaSkipped``.
+    """
+    try:
+        prepared = [downscale_image(image_bytes) for image_bytes in images]
     except Exception as e:
-        st.error(f"Error generating outfit combinations: {e}")
-        return None
+        return [e] * len(images)
+
+    if len(prepared) > 1 and not quota_exhausted.is_set():
+        try:
+            return [_to_clothing_items(catalog) for catalog in analyze_images(prepared)]
+        except ValueError:
+            # A malformed batch answer says nothing about the images themselves, so retry them one by one
+            pass
+        except Exception as e:
+            if _is_quota_error(e):
+                quota_exhausted.set()
+            return [e] * len(images)
+
+    catalogs = []
+    for image_bytes in prepared:
+        if quota_exhausted.is_set():
+            catalogs.extend(QuotaSkipped() for _ in range(len(prepared) - len(catalogs)))
+            break
+        try:
+            catalogs.append(_to_clothing_items(analyze_image(image_bytes)))
+        except Exception as e:
+            if _is_quota_error(e):
+                # Retrying the rest of the batch would only hit the same quota
+                quota_exhausted.set()
+                catalogs.extend([e] * (len(prepared) - len(catalogs)))
+                break
+            catalogs.append(e)
+    return catalogs
+
+
+# Function to generate outfit combinations using Gemini
+# Yields text chunks as they arrive so the page can render them immediately.
+def stream_outfit_combinations(catalog):
+    prompt = f"""Given the following clothing catalog, generate at least three distinct outfit combinations. Provide a short description for each outfit.
+
+        Catalog:
+{format_catalog_text(catalog)}
+    """
+    for chunk in get_outfit_model().generate_content(prompt, stream=True, request_options=REQUEST_OPTIONS):
+        if chunk.parts:
+            yield chunk.text
+
+
+CATALOG_TEXT_TEMPLATE = (
+    "Description: {description}\n"
+    "Category: {category}\n"
+    "Colors: {colors}\n"
+    "Style: {style}\n"
+    "Gender Type: {gender_type}\n"
+    "Suitable Weather: {suitable_weather}\n"
+    "Material: {material}\n"
+    "Occasion: {occasion}\n"
+    + "-" * 30 + "\n"
+)
+
+
+def format_catalog_text(catalog):
+    """Render the catalog as plain text for the downloadable report."""
+    return "".join(
+        CATALOG_TEXT_TEMPLATE.format(
+            description=item.description,
+            category=item.category,
+            colors=', '.join(item.colors),
+            style=', '.join(item.style),
+            gender_type=item.gender_type,
+            suitable_weather=item.suitable_weather,
+            material=item.material,
+            occasion=item.occasion,
+        )
+        for item in catalog
+    )
+
+
+# The catalog is identified by its image digests, so the item list itself is not hashed.
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_report(catalog_key, _catalog, outfit_combinations) -> bytes:
+    """Return the downloadable wardrobe report, built once per catalog and outfit text."""
+    # Convert catalog to human-readable text
+    catalog_text = format_catalog_text(_catalog)
+
+    # Combine catalog and outfits
+    combined_text = f"Clothing Catalog:\n{catalog_text}\n\nOutfit Combinations:\n{outfit_combinations}"
+    return combined_text.encode('utf-8')
+
+
+@st.fragment
+def render_catalog(catalog):
+    """Show one expander per catalog item; reruns triggered inside stay scoped here."""
+    for item in catalog:
+        with st.expander(f"Item: {item.description}", expanded=True):
+            st.markdown(f"**Category:** {item.category}")
+            st.markdown(f"**Colors:** {', '.join(item.colors)}")
+            st.markdown(f"**Style:** {', '.join(item.style)}")
+            st.markdown(f"**Gender Type:** {item.gender_type}")
+            st.markdown(f"**Suitable Weather:** {item.suitable_weather}")
+            st.markdown(f"**Material:** {item.material}")
+            st.markdown(f"**Occasion:** {item.occasion}")
+            st.markdown("---")
+
+
+@st.fragment
+def render_outfits(catalog_key, catalog):
+    """Show outfit suggestions and the report download; reruns triggered inside stay scoped here."""
+    # Finished suggestions are kept per catalog so revisiting the page doesn't re-hit Gemini
+    outfit_cache = st.session_state.setdefault('outfit_combinations', {})
+    outfit_combinations = outfit_cache.get(catalog_key)
+
+    st.subheader("Outfit Suggestions:")
+    if outfit_combinations is not None:
+        st.markdown(outfit_combinations)
+    else:
+        # Generate outfit combinations, rendering tokens as they stream in
+        try:
+            outfit_combinations = st.write_stream(stream_outfit_combinations(catalog))
+        except Exception as e:
+            st.error(f"Error generating outfit combinations: {e}")
+        else:
+            # An empty answer (e.g. safety-filtered) isn't cached, so the next visit retries
+            if outfit_combinations:
+                outfit_cache[catalog_key] = outfit_combinations
+
+    if not outfit_combinations:
+        st.error("Could not generate outfit combinations")
+        return
+
+    # Download combined button
+    st.download_button(
+        label="Download Catalog and Outfits",
+        data=build_report(catalog_key, catalog, outfit_combinations),
+        file_name="wardrobe_report.txt",
+        mime="text/plain",
+    )
+    st.markdown(
+        f"""
+        <a href="https://ai-fashion-assistant.streamlit.app/" target="_blank">
+            <button style="background-color:#4CAF50; color:white; padding:10px 20px; border:none; border-radius:5px; cursor:pointer; text-decoration: none;">
+                Go to Next Step
+            </button>
+         </a>
+        """,
+        unsafe_allow_html=True
+    )
+
 
 # Main Streamlit app
 def main():
     st.title("Wardrobe Styling App")
 
+    # Only the key is checked here; the SDK itself is imported when a model is first needed
+    try:
+        _get_api_key()
+    except RuntimeError as e:
+        st.error(str(e))
+        st.stop()
+
     # Sidebar for navigation
     st.sidebar.title("Navigation")
     page = st.sidebar.radio("Go to", ["Dashboard", "Outfit Combinations"])
@@ -100,87 +535,89 @@ def main():
         
         if uploaded_images:
             all_catalogs = []
-            # Display the images and their analysis results
-            for uploaded_image in uploaded_images:
-                if uploaded_image:
-                   st.image(uploaded_image, caption="Uploaded Wardrobe Image", use_column_width=True)
-                   with st.spinner(f"Analyzing Image..."):
-                         catalog = analyze_image(uploaded_image)
-                         if catalog:
-                             all_catalogs.extend(catalog)
-                         else:
-                             st.error("Could not get analysis, please try again for one of the images.")
+            uploaded_images = [uploaded_image for uploaded_image in uploaded_images if uploaded_image]
+            # Read every buffer up front; workers only ever see plain bytes
+            images = [uploaded_image.getvalue() for uploaded_image in uploaded_images]
+            digests = [image_digest(image_bytes) for image_bytes in images]
+            results = [None] * len(images)
+            # (upload index, reason) for every image that could not be analyzed
+            failed = []
+            # Only valid images missing from the catalog store need a Gemini call
+            pending = []
+            for index, digest in enumerate(digests):
+                stored = load_catalog(digest)
+                if stored is not None:
+                    results[index] = stored
+                    continue
+                # Stored images were valid when analyzed, so only cache misses are checked
+                problem = validate_image(images[index])
+                if problem:
+                    failed.append((index, problem))
+                else:
+                    pending.append(index)
+            if pending:
+                # Several images share one request; the batches themselves run concurrently
+                batches = [pending[i:i + MAX_IMAGES_PER_REQUEST] for i in range(0, len(pending), MAX_IMAGES_PER_REQUEST)]
+                # Shared with the workers so running batches stop sending requests too
+                quota_exhausted = threading.Event()
+                with st.spinner("Analyzing Images..."):
+                    with ThreadPoolExecutor(max_workers=min(MAX_ANALYZE_WORKERS, len(batches))) as executor:
+                        futures = {executor.submit(_analyze_uploads, [images[index] for index in batch], quota_exhausted): batch
+                                   for batch in batches}
+                        for future in as_completed(futures):
+                            batch = futures[future]
+                            if future.cancelled():
+                                failed.extend((index, "Skipped because the Gemini quota is exhausted.") for index in batch)
+                                continue
+                            catalogs = future.result()
+                            for index, catalog in zip(batch, catalogs):
+                                if isinstance(catalog, QuotaSkipped):
+                                    failed.append((index, "Skipped because the Gemini quota is exhausted."))
+                                elif isinstance(catalog, Exception):
+                                    failed.append((index, f"Error analyzing image: {catalog}"))
+                                elif catalog:
+                                    results[index] = catalog
+                                    save_catalog(digests[index], catalog)
+                                else:
+                                    failed.append((index, "Could not get analysis, please try again."))
+                            # Batches still queued behind the pool are dropped without starting
+                            if quota_exhausted.is_set():
+                                for queued in futures:
+                                    queued.cancel()
+
+            # Display the analyzed images in upload order
+            analyzed_digests = []
+            for digest, image_bytes, catalog in zip(digests, images, results):
+                if catalog is None:
+                    continue
+                try:
+                    st.image(make_preview(image_bytes), caption="Uploaded Wardrobe Image", use_container_width=True)
+                except OSError as e:
+                    st.warning(f"Could not preview image: {e}")
+                all_catalogs.extend(catalog)
+                analyzed_digests.append(digest)
             if all_catalogs:
-                 st.session_state.catalog = all_catalogs
+                 # Only the digests live in the session; the catalog store is the source of truth
+                 st.session_state.catalog_hashes = analyzed_digests
                  st.subheader("Clothing Catalog:")
-                 for item in all_catalogs:
-                    with st.expander(f"Item: {item.get('description', 'N/A')}", expanded=True):
-                        st.markdown(f"**Category:** {item.get('category', 'N/A')}")
-                        st.markdown(f"**Colors:** {', '.join(item.get('colors', ['N/A']))}")
-                        st.markdown(f"**Style:** {', '.join(item.get('style', ['N/A']))}")
-                        st.markdown(f"**Gender Type:** {item.get('gender_type', 'N/A')}")
-                        st.markdown(f"**Suitable Weather:** {item.get('suitable_weather', 'N/A')}")
-                        st.markdown(f"**Material:** {item.get('material', 'N/A')}")
-                        st.markdown(f"**Occasion:** {item.get('occasion', 'N/A')}")
-                        st.markdown("---")
+                 render_catalog(all_catalogs)
                  st.success("Image Analysis Complete!")
 
             else:
                 st.error("Could not get analysis, please try again for all images.")
 
+            if failed:
+                st.warning("Some images could not be analyzed:\n" + "\n".join(
+                    f"- **{uploaded_images[index].name}**: {reason}" for index, reason in sorted(failed)))
+
     # Outfit Combinations page
     elif page == "Outfit Combinations":
             st.header("Outfit Combinations")
-            # This is a very basic example.
-            # In a real application you should be using a persisted catalog from the dashboard
-            # For this example we will use the same response from the dashboard page
-            if 'catalog' in st.session_state:
-                catalog = st.session_state.catalog
-
-                # Generate outfit combinations
-                with st.spinner("Generating Outfit Combinations..."):
-                    outfit_combinations = generate_outfit_combinations(catalog)
-
-                if outfit_combinations:
-                    st.subheader("Outfit Suggestions:")
-                    st.markdown(outfit_combinations)
-
-                   # Convert catalog to human-readable text
-                    catalog_text = ""
-                    for item in catalog:
-                        catalog_text += f"Description: {item.get('description', 'N/A')}\n"
-                        catalog_text += f"Category: {item.get('category', 'N/A')}\n"
-                        catalog_text += f"Colors: {', '.join(item.get('colors', ['N/A']))}\n"
-                        catalog_text += f"Style: {', '.join(item.get('style', ['N/A']))}\n"
-                        catalog_text += f"Gender Type: {item.get('gender_type', 'N/A')}\n"
-                        catalog_text += f"Suitable Weather: {item.get('suitable_weather', 'N/A')}\n"
-                        catalog_text += f"Material: {item.get('material', 'N/A')}\n"
-                        catalog_text += f"Occasion: {item.get('occasion', 'N/A')}\n"
-                        catalog_text += "-" * 30 + "\n"
-
-                    # Combine catalog and outfits
-                    combined_text = f"Clothing Catalog:\n{catalog_text}\n\nOutfit Combinations:\n{outfit_combinations}"
-                    # Download combined button
-                    st.download_button(
-                        label="Download Catalog and Outfits",
-                        data=combined_text.encode('utf-8'),
-                        file_name="wardrobe_report.txt",
-                        mime="text/plain",
-                    )
-                    st.markdown(
-                        f"""
-                        <a href="https://ai-fashion-assistant.streamlit.app/" target="_blank">
-                            <button style="background-color:#4CAF50; color:white; padding:10px 20px; border:none; border-radius:5px; cursor:pointer; text-decoration: none;">
-                                Go to Next Step
-                            </button>
-                         </a>
-                        """,
-                            unsafe_allow_html=True
-                        )
-
-
-                else:
-                    st.error("Could not generate outfit combinations")
+            # Load the catalogs persisted by the dashboard page for this session's images
+            catalog_key = tuple(st.session_state.get('catalog_hashes', []))
+            catalog = load_catalogs(catalog_key)
+            if catalog:
+                render_outfits(catalog_key, catalog)
             else:
                st.warning("Please upload an image in the dashboard page to generate outfit combinations.")
 